@@ -0,0 +1,112 @@
+# localslackirc
+# Copyright (C) 2023-2026 Salvo "LtWorf" Tomaselli
+#
+# localslackirc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# localslackirc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with localslackirc.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import irc
+
+
+# Cap on concurrently served control connections: with the size-bounded
+# payload reads this bounds the memory a flood of clients can pin.
+_SEM = asyncio.Semaphore(16)
+
+# Longest message payload a write command may carry.
+_MAX_WRITE_SIZE = 1024 * 1024
+
+_OK = b'ok'
+_FAIL = b'fail'
+_CMD_SENDFILE = b'sendfile'
+_CMD_WRITE = b'write'
+
+
+async def handle_write(ircclient: 'irc.Client', args: list[bytes], reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    dest = args[0].decode()
+    # The payload runs until EOF but is capped, otherwise the
+    # semaphore's bounded-memory guarantee would not hold.
+    buf = bytearray()
+    while len(buf) <= _MAX_WRITE_SIZE:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        buf += chunk
+    if len(buf) > _MAX_WRITE_SIZE:
+        writer.write(_FAIL)
+        await writer.drain()
+        return
+    data = buf.decode()
+    try:
+        await ircclient.send_message(dest, data)
+        writer.write(_OK)
+    except Exception:
+        writer.write(_FAIL)
+    await writer.drain()
+
+
+async def handle_sendfile(ircclient: 'irc.Client', args: list[bytes], reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    dest = args[0].decode()
+    filename = args[1].decode()
+    # The sender declares the payload size so the file is read with a
+    # bounded readexactly rather than slurping the stream to EOF.
+    size = int(args[2])
+    content = await reader.readexactly(size)
+    try:
+        await ircclient.send_file(dest, filename, content)
+        writer.write(_OK)
+    except Exception:
+        writer.write(_FAIL)
+    await writer.drain()
+
+
+_DISPATCH: dict[bytes, Callable[..., Awaitable[None]]] = {
+    _CMD_SENDFILE: handle_sendfile,
+    _CMD_WRITE: handle_write,
+}
+
+
+async def handle_client(ircclient: 'irc.Client', reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        async with _SEM:
+            # The command and its parameters arrive as one header frame
+            # terminated by an empty line, so parsing costs a single
+            # readuntil instead of a buffer scan per line.
+            try:
+                header = (await reader.readuntil(b'\n\n')).split(b'\n')
+            except asyncio.IncompleteReadError:
+                # Peer went away before completing the header
+                return
+            except asyncio.LimitOverrunError:
+                writer.write(_FAIL)
+                return
+            handler = _DISPATCH.get(header[0])
+            if handler is not None:
+                try:
+                    await handler(ircclient, header[1:-2], reader, writer)
+                except (IndexError, ValueError, asyncio.IncompleteReadError):
+                    # Malformed frame: missing arguments, a bad size
+                    # field, or a payload shorter than declared
+                    writer.write(_FAIL)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def listen(ircclient: 'irc.Client', socket_path: str) -> None:
+    server = await asyncio.start_unix_server(partial(handle_client, ircclient), socket_path)
+    async with server:
+        await server.serve_forever()
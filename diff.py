@@ -0,0 +1,82 @@
+# localslackirc
+# Copyright (C) 2018-2026 Salvo "LtWorf" Tomaselli
+#
+# localslackirc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# localslackirc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with localslackirc.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+__all__ = ['seddiff']
+
+
+_SEPARATORS = frozenset(' .,:;\t\n()[]{}')
+_SEP_CLASS = re.escape(''.join(_SEPARATORS))
+_TOKEN_RE = re.compile('[^%s]+|[%s]' % (_SEP_CLASS, _SEP_CLASS))
+
+
+def wordsplit(word: str) -> list[str]:
+    return _TOKEN_RE.findall(word)
+
+
+def seddiff(a: str, b: str) -> str:
+    '''
+    Original string, changed string
+
+    Returns a description of the change
+    in a sed-like format s/before/after/
+    '''
+    if a == b:
+        return ''
+
+    # Nothing in common at either end: the whole strings are the diff,
+    # no need to tokenize and scan.
+    if not a or not b or (a[0] != b[0] and a[-1] != b[-1]):
+        return 's/%s/%s/' % (a.strip(), b.strip())
+
+    l1 = wordsplit(a)
+    l2 = wordsplit(b)
+
+    n1 = len(l1)
+    n2 = len(l2)
+    n = min(n1, n2)
+
+    prefix = 0
+    while prefix < n and l1[prefix] == l2[prefix]:
+        prefix += 1
+
+    # Positive indices from the cached lengths: negative subscripts get
+    # normalized on every iteration.
+    postfix = 0
+    while postfix < n - prefix and l1[n1 - 1 - postfix] == l2[n2 - 1 - postfix]:
+        postfix += 1
+
+    px = max(n1, n2) - postfix
+
+    # The tokens partition the inputs, so the changed region can be cut
+    # straight out of the original strings instead of re-joining token
+    # slices. bounds*[i] is the char offset where token i starts.
+    bounds1 = [0] * (n1 + 1)
+    acc = 0
+    for i, t in enumerate(l1):
+        acc += len(t)
+        bounds1[i + 1] = acc
+    bounds2 = [0] * (n2 + 1)
+    acc = 0
+    for i, t in enumerate(l2):
+        acc += len(t)
+        bounds2[i + 1] = acc
+
+    return 's/%s/%s/' % (
+        a[bounds1[prefix]:bounds1[min(px, n1)]].strip(),
+        b[bounds2[prefix]:bounds2[min(px, n2)]].strip(),
+    )
@@ -0,0 +1,984 @@
+#!/usr/bin/env python3
+# localslackirc
+# Copyright (C) 2018-2026 Salvo "LtWorf" Tomaselli
+#
+# localslackirc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# localslackirc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with localslackirc.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import re
+import signal
+import socket
+import tempfile
+from enum import IntEnum
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional, Union
+
+import control
+import msgparsing
+import slack
+from diff import seddiff
+
+log = logging.getLogger(__name__)
+
+# Constant for the process lifetime, embedded in every IRC line
+_HOSTNAME: bytes = socket.gethostname().encode('utf8')
+
+_ATTACHMENT_PREFIX = 'localslackirc-attachment-'
+
+# Write buffer size above which the senders actually yield and wait.
+# Kept below asyncio's default pause threshold so backpressure still
+# engages for a truly slow client.
+_HIGH_WATER = 64 * 1024
+
+# An IRC command can never legitimately get this long: a client that
+# sends this much without a newline gets disconnected.
+_MAX_LINE = 64 * 1024
+
+# Escapes and group mention keywords applied to outgoing messages,
+# all rewritten in a single scan of the message.
+_MAGIC_TABLE = {char: wire for wire, char in msgparsing.SLACK_SUBSTITUTIONS}
+_MAGIC_TABLE.update({
+    '@here': '<!here>',
+    '@channel': '<!channel>',
+    '@everyone': '<!everyone>',
+})
+# The group mentions take a word-boundary guard so e.g. '@channels'
+# is left alone; the single-character escapes need none.
+_MAGIC_RE = re.compile('|'.join(
+    re.escape(k) + (r'\b' if k.startswith('@') else '')
+    for k in _MAGIC_TABLE
+))
+
+# The reverse direction, wire escapes back to characters, also done in
+# one scan instead of one str.replace pass per escape.
+_UNESCAPE_TABLE = {wire: char for wire, char in msgparsing.SLACK_SUBSTITUTIONS}
+_UNESCAPE_RE = re.compile('|'.join(re.escape(w) for w in _UNESCAPE_TABLE))
+
+
+def _unescape(m: re.Match) -> str:
+    return _UNESCAPE_TABLE[m.group(0)]
+
+
+def _canon(name: bytes) -> bytes:
+    '''
+    Canonical form of an IRC channel name.
+
+    Slack-side names come from name_normalized and are already in this
+    form, so only names typed by the IRC user need converting.
+    '''
+    return name.lower()
+
+
+def _enc(s: str) -> bytes:
+    '''
+    Encode for the IRC socket.
+
+    Message text and names are almost always plain ASCII, where
+    CPython's ascii codec is a straight copy of the internal buffer;
+    anything else takes the generic utf8 path.
+    '''
+    return s.encode('ascii') if s.isascii() else s.encode('utf8')
+
+
+@lru_cache(maxsize=64)
+def _first_chars(usernames: frozenset[str]) -> frozenset[str]:
+    '''
+    First character of every username, used to rule out mention
+    matches without running the pattern: frozenset.isdisjoint scans
+    the message at C speed.
+    '''
+    return frozenset(u[0] for u in usernames if u)
+
+
+@lru_cache(maxsize=64)
+def _compile_mentions(usernames: frozenset[str]) -> Optional[re.Pattern]:
+    '''
+    Compiled mention regexp for a set of usernames.
+
+    Cached on the membership itself, so joins and parts that end up
+    with the same set of names reuse the compiled pattern.
+    '''
+    if not usernames:
+        return None
+    # Longest first: alternation picks the leftmost branch, so a name
+    # that is a prefix of another must come after it.
+    return re.compile(
+        '|'.join(
+            r'((://\S*){0,1}\b%s\b)' % re.escape(u)
+            for u in sorted(usernames, key=len, reverse=True)
+        )
+    )
+
+
+class Replies(IntEnum):
+    RPL_WELCOME = 1
+    RPL_AWAY = 301
+    RPL_UNAWAY = 305
+    RPL_NOWAWAY = 306
+    RPL_WHOISUSER = 311
+    RPL_ENDOFWHO = 315
+    RPL_ENDOFWHOIS = 318
+    RPL_LIST = 322
+    RPL_LISTEND = 323
+    RPL_TOPIC = 332
+    RPL_WHOREPLY = 352
+    RPL_NAMREPLY = 353
+    RPL_ENDOFNAMES = 366
+    ERR_NOSUCHNICK = 401
+    ERR_NOSUCHCHANNEL = 403
+    ERR_UNKNOWNCOMMAND = 421
+    ERR_NEEDMOREPARAMS = 461
+
+
+class ClientSettings(NamedTuple):
+    nouserlist: bool
+    autojoin: bool
+    downloads_directory: Path
+    formatted_max_lines: int = 0
+    silenced_yellers: frozenset[str] = frozenset()
+    ignored_channels: frozenset[bytes] = frozenset()
+
+    async def verify(self) -> Optional[str]:
+        '''
+        Make sure the settings are sane.
+
+        Returns a error message string or None.
+        '''
+        if not self.downloads_directory.is_dir():
+            return f'Not a directory: {self.downloads_directory}'
+        return None
+
+
+class Client:
+    __slots__ = (
+        'nick',
+        'username',
+        'realname',
+        'parted_channels',
+        'settings',
+        's',
+        'sl_client',
+        '_usersent',
+        '_held_events',
+        '_mention_names_cache',
+        '_annoy_users',
+        '_last_typing',
+        '_mention_str',
+        '_event_handlers',
+        '_user_prefix_cache',
+        '_enc_name',
+        '_loop',
+        '_channel_id_by_bytes',
+        '_chan_dest_cache',
+    )
+
+    def __init__(
+            self,
+            s: asyncio.StreamWriter,
+            sl_client: slack.Slack,
+            settings: ClientSettings,
+    ) -> None:
+        self.nick = b''
+        self.username = b''
+        self.realname = b''
+        self.parted_channels: set[bytes] = {_canon(c) for c in settings.ignored_channels}
+        self.settings = settings
+        self.s = s
+        self.sl_client = sl_client
+        # Monotonic clock of the loop, used for all the deadlines: no
+        # extra CLOCK_REALTIME syscall and immune to NTP adjustments.
+        self._loop = asyncio.get_running_loop()
+
+        # Events are held back until the IRC client has registered.
+        # Bounded: a client that connects but never completes the
+        # handshake must not pin unlimited memory.
+        self._usersent = False
+        self._held_events: collections.deque[slack.SlackEvent] = collections.deque(maxlen=4096)
+        self._mention_names_cache: dict[str, frozenset[str]] = {}
+        self._annoy_users: dict[str, float] = {}
+        self._last_typing: dict[tuple[str, str], float] = {}
+        self._mention_str = ''
+        self._user_prefix_cache: dict[bytes, bytes] = {}
+        self._enc_name: dict[str, tuple[bytes, bytes]] = {}
+        self._channel_id_by_bytes: dict[bytes, str] = {}
+        self._chan_dest_cache: dict[str, bytes] = {}
+
+        # Events from _loadevent always carry their concrete type, so
+        # dispatch on type() directly rather than walking an isinstance
+        # chain for every event.
+        self._event_handlers = {
+            slack.MessageEdit: self._messageedit,
+            slack.MessageDelete: self._messagedeleted,
+            slack.ActionMessage: self._actionmessage,
+            slack.Message: self._message,
+            slack.Join: self._joined,
+            slack.Leave: self._left,
+            slack.TopicChange: self._topicchanged,
+            slack.GroupJoined: self._groupjoined,
+            slack.UserTyping: self._usertyping,
+        }
+
+    async def _maybe_drain(self) -> None:
+        '''
+        Drain only when the write buffer is actually filling up,
+        instead of yielding to the loop after every reply.
+        '''
+        if self.s.transport.get_write_buffer_size() > _HIGH_WATER:
+            await self.s.drain()
+
+    def _user_prefix(self, nick: bytes) -> bytes:
+        '''
+        The ":nick!nick@127.0.0.1 " prefix of the lines originating
+        from a user, formatted once and reused.
+        '''
+        prefix = self._user_prefix_cache.get(nick)
+        if prefix is None:
+            prefix = b':%s!%s@127.0.0.1 ' % (nick, nick)
+            self._user_prefix_cache[nick] = prefix
+        return prefix
+
+    def _enc_user(self, u: slack.User) -> tuple[bytes, bytes]:
+        '''
+        (name, real name) of a user, encoded once and cached by id.
+
+        Every message, join and part needs the sender's name as bytes;
+        without the cache each event re-encodes the same strings.
+        '''
+        t = self._enc_name.get(u.id)
+        if t is None:
+            t = (_enc(u.name), _enc(u.real_name))
+            self._enc_name[u.id] = t
+        return t
+
+    def _chan_dest(self, channel: slack.Channel) -> bytes:
+        '''
+        The "#name" bytes of a channel, encoded once and cached by id.
+        '''
+        dest = self._chan_dest_cache.get(channel.id)
+        if dest is None:
+            dest = b'#' + _enc(channel.name)
+            self._chan_dest_cache[channel.id] = dest
+        return dest
+
+    async def _nickhandler(self, cmd: bytes) -> None:
+        nick = cmd[cmd.find(b' ') + 1:]
+        self.nick = nick.strip().removeprefix(b':')
+
+    async def _userhandler(self, cmd: bytes) -> None:
+        assert self.sl_client.login_info
+        team = self.sl_client.login_info.team.name.encode('utf8')
+        # Loop-invariant for the lifetime of the client: compute once
+        # instead of on every inbound message.
+        self._mention_str = f'<@{self.sl_client.login_info.self.id}>'
+
+        # The welcome burst goes out as one buffer and one drain
+        buf = bytearray()
+        buf += b':%s 001 %s :Welcome to localslackirc\r\n' % (_HOSTNAME, self.nick)
+        buf += b':%s 002 %s :Your team is %s\r\n' % (_HOSTNAME, self.nick, team)
+        buf += b':%s 376 %s :End of MOTD\r\n' % (_HOSTNAME, self.nick)
+        self.s.write(bytes(buf))
+        await self._maybe_drain()
+
+        if self.settings.autojoin:
+            # One users.list call beats resolving the same people over
+            # and over while joining.
+            if not self.settings.nouserlist:
+                await self.sl_client.prefetch_users()
+            # The membership fetches are HTTP round trips: overlap them
+            # so the join phase takes about as long as the slowest
+            # channel instead of the sum. Each channel burst is still
+            # written as one piece, so the output does not interleave.
+            joins = []
+            for sl_chan in await self.sl_client.channels():
+                if not sl_chan.is_member:
+                    continue
+                channel_name = b'#' + sl_chan.name_normalized.encode('utf-8')
+                if channel_name in self.parted_channels:
+                    continue
+                joins.append(self._send_chan_info(channel_name, sl_chan))
+            if joins:
+                await asyncio.gather(*joins)
+
+        self._usersent = True
+        # Events may keep arriving while one is replayed: pop from the
+        # left so late arrivals are neither lost nor replayed twice.
+        while self._held_events:
+            await self.slack_event(self._held_events.popleft())
+
+    async def _pinghandler(self, cmd: bytes) -> None:
+        lbl = cmd[cmd.find(b' ') + 1:]
+        self.s.writelines((b':', _HOSTNAME, b' PONG ', _HOSTNAME, b' ', lbl, b'\r\n'))
+        await self._maybe_drain()
+
+    async def _joinhandler(self, cmd: bytes) -> None:
+        channel_name = cmd[cmd.find(b' ') + 1:]
+        for name in channel_name.split(b','):
+            self.parted_channels.discard(_canon(name))
+            try:
+                slchan = await self.sl_client.get_channel_by_name(name[1:].decode())
+            except (KeyError, slack.ResponseException):
+                continue
+            await self._send_chan_info(name, slchan)
+
+    async def _send_chan_info(self, channel_name: bytes, slchan: slack.Channel) -> None:
+        names: list[bytes] = []
+        if not self.settings.nouserlist:
+            members = await self.sl_client.get_members(slchan.id)
+            names = [
+                (b'@' if u.is_admin else b'') + self._enc_user(u)[0]
+                for u in await self.sl_client.get_users(members)
+                if not u.deleted
+            ]
+
+        topic = _enc(slchan.topic.value)
+        buf = bytearray()
+        buf += self._user_prefix(self.nick) + b'JOIN ' + channel_name + b'\r\n'
+        buf += b':%s %03d %s %s :%s\r\n' % (_HOSTNAME, Replies.RPL_TOPIC, self.nick, channel_name, topic)
+
+        # IRC lines are capped at 512 bytes: spread the member list
+        # over as many 353 replies as needed, all appended to the same
+        # buffer so the whole join still goes out as one write.
+        header = b':%s %03d %s = %s :' % (_HOSTNAME, Replies.RPL_NAMREPLY, self.nick, channel_name)
+        line = bytearray(header)
+        for n in names:
+            if len(line) + len(n) + 1 > 480:
+                buf += line
+                buf += b'\r\n'
+                line = bytearray(header)
+            line += n
+            line += b' '
+        buf += line
+        buf += b'\r\n'
+
+        buf += b':%s %03d %s %s :End of NAMES list\r\n' % (_HOSTNAME, Replies.RPL_ENDOFNAMES, self.nick, channel_name)
+        self.s.write(bytes(buf))
+        await self._maybe_drain()
+
+    async def _parthandler(self, cmd: bytes) -> None:
+        _, _, rest = cmd.partition(b' ')
+        channels, _, _ = rest.partition(b' ')
+        # Same comma-list form JOIN accepts
+        for name in channels.split(b','):
+            self.parted_channels.add(_canon(name))
+
+    async def _awayhandler(self, cmd: bytes) -> None:
+        is_away = b' ' in cmd
+        await self.sl_client.away(is_away)
+        code = Replies.RPL_NOWAWAY if is_away else Replies.RPL_UNAWAY
+        await self._sendreply(code, b'Away status changed')
+
+    async def _topichandler(self, cmd: bytes) -> None:
+        _, _, rest = cmd.partition(b' ')
+        channel_name, _, topic = rest.partition(b' ')
+        try:
+            channel = await self.sl_client.get_channel_by_name(channel_name[1:].decode())
+            await self.sl_client.topic(channel.id, topic.removeprefix(b':').decode('utf8'))
+        except (KeyError, slack.ResponseException):
+            await self._sendreply(Replies.ERR_NOSUCHCHANNEL, b'No such channel', [channel_name])
+
+    async def _modehandler(self, cmd: bytes) -> None:
+        _, _, rest = cmd.partition(b' ')
+        target, _, _ = rest.partition(b' ')
+        await self._sendreply(324, b'', [target, b'+'])
+
+    async def _annoyhandler(self, cmd: bytes) -> None:
+        _, _, rest = cmd.partition(b' ')
+        user, _, duration_b = rest.partition(b' ')
+        try:
+            username = user.decode('utf8')
+            duration = int(duration_b) if duration_b else 10
+        except ValueError:
+            username = ''
+        if not username:
+            await self._sendreply(Replies.ERR_UNKNOWNCOMMAND, b'Syntax: ANNOY user [minutes]')
+            return
+        self._annoy_users[username] = self._loop.time() + duration * 60
+        await self._sendreply(0, b'Annoying %s for %d minutes' % (user, duration))
+
+    async def _whohandler(self, cmd: bytes) -> None:
+        _, _, name = cmd.partition(b' ')
+        if not name.startswith(b'#'):
+            return
+        try:
+            channel = await self.sl_client.get_channel_by_name(name[1:].decode())
+        except (KeyError, slack.ResponseException):
+            return
+        members = await self.sl_client.get_members(channel.id)
+        # The per-line format only varies in the user fields: format
+        # the invariant parts once outside the loop.
+        prefix = b':%s %03d %s %s ' % (_HOSTNAME, Replies.RPL_WHOREPLY, self.nick, name)
+        mid = b' 127.0.0.1 ' + _HOSTNAME + b' '
+        buf = bytearray()
+        for u in await self.sl_client.get_users(members):
+            if u.deleted:
+                continue
+            uname, realname = self._enc_user(u)
+            buf += prefix
+            buf += uname
+            buf += mid
+            buf += uname
+            buf += b' H :0 '
+            buf += realname
+            buf += b'\r\n'
+        buf += b':%s %03d %s %s :End of WHO list\r\n' % (_HOSTNAME, Replies.RPL_ENDOFWHO, self.nick, name)
+        self.s.write(bytes(buf))
+        await self._maybe_drain()
+
+    async def _whoishandler(self, cmd: bytes) -> None:
+        _, _, username = cmd.partition(b' ')
+        try:
+            user = await self.sl_client.get_user_by_name(username.decode('utf8'))
+        except KeyError:
+            await self._sendreply(Replies.ERR_NOSUCHNICK, b'No such nick', [username])
+            return
+        buf = bytearray()
+        buf += b':%s %03d %s %s %s 127.0.0.1 * :%s\r\n' % (
+            _HOSTNAME,
+            Replies.RPL_WHOISUSER,
+            self.nick,
+            username,
+            username,
+            self._enc_user(user)[1],
+        )
+        buf += b':%s %03d %s %s :End of WHOIS\r\n' % (_HOSTNAME, Replies.RPL_ENDOFWHOIS, self.nick, username)
+        self.s.write(bytes(buf))
+        await self._maybe_drain()
+
+    async def _listhandler(self, cmd: bytes) -> None:
+        # A workspace can have thousands of channels: build the whole
+        # reply and hand it to the transport in one go instead of one
+        # write per channel.
+        prefix = b':%s %03d %s #' % (_HOSTNAME, Replies.RPL_LIST, self.nick)
+        lines = [
+            b''.join((prefix, _enc(c.name), b' %d :' % c.num_members, _enc(c.topic.value), b'\r\n'))
+            for c in await self.sl_client.channels(refresh=True)
+        ]
+        lines.append(b':%s %03d %s :End of LIST\r\n' % (_HOSTNAME, Replies.RPL_LISTEND, self.nick))
+        self.s.writelines(lines)
+        await self._maybe_drain()
+
+    async def _quithandler(self, cmd: bytes) -> None:
+        self.s.close()
+
+    async def _privmsghandler(self, cmd: bytes) -> None:
+        # find+slice over split: no intermediate list on the most
+        # frequent command of them all.
+        sp1 = cmd.find(b' ')
+        sp2 = cmd.find(b' ', sp1 + 1)
+        if sp2 < 0:
+            # No text part: negative offsets would silently misparse
+            await self._sendreply(Replies.ERR_NEEDMOREPARAMS, b'Not enough parameters', [b'PRIVMSG'])
+            return
+        dest = cmd[sp1 + 1:sp2]
+        msg = cmd[sp2 + 1:].removeprefix(b':')
+
+        if msg.startswith(b'\x01ACTION ') and msg.endswith(b'\x01'):
+            action = True
+            msg = msg[8:-1]
+        else:
+            action = False
+
+        message = await self._addmagic(msg.decode('utf8'), dest)
+        if dest.startswith(b'#'):
+            # Decode and resolve the destination once per channel: the
+            # following messages to it only pay a dict lookup.
+            cid = self._channel_id_by_bytes.get(dest)
+            if cid is None:
+                try:
+                    cid = (await self.sl_client.get_channel_by_name(dest[1:].decode('utf8'))).id
+                except (KeyError, slack.ResponseException):
+                    await self._sendreply(Replies.ERR_NOSUCHCHANNEL, b'No such channel', [dest])
+                    return
+                self._channel_id_by_bytes[dest] = cid
+            await self.sl_client.send_message(cid, message, action)
+        else:
+            try:
+                user = await self.sl_client.get_user_by_name(dest.decode('utf8'))
+            except KeyError:
+                await self._sendreply(Replies.ERR_NOSUCHNICK, b'No such nick', [dest])
+                return
+            await self.sl_client.send_message_to_user(user.id, message, action)
+
+    async def _get_mention_names(self, dest: bytes) -> frozenset[str]:
+        key = dest.decode('utf8')
+        names = self._mention_names_cache.get(key)
+        if names is None:
+            if not dest.startswith(b'#'):
+                names = frozenset()
+            else:
+                try:
+                    channel = await self.sl_client.get_channel_by_name(key[1:])
+                    members = await self.sl_client.get_members(channel.id)
+                except (KeyError, slack.ResponseException):
+                    members = set()
+                names = frozenset(u.name for u in await self.sl_client.get_users(members))
+            self._mention_names_cache[key] = names
+        return names
+
+    async def _addmagic(self, msg: str, dest: bytes) -> str:
+        '''
+        Prepare a message to be sent to slack: escape the entities
+        and convert mentions into slack format.
+        '''
+        msg = _MAGIC_RE.sub(lambda m: _MAGIC_TABLE[m.group(0)], msg)
+
+        usernames = await self._get_mention_names(dest)
+        # Most messages mention nobody: skip the regex entirely when
+        # no character of the message starts any username.
+        if not usernames or _first_chars(usernames).isdisjoint(msg):
+            return msg
+        regexp = _compile_mentions(usernames)
+        if regexp is None:
+            return msg
+
+        # Resolve all the mentioned names concurrently, then rewrite
+        # the message in a single substitution pass.
+        names = list({
+            m.group(0) for m in regexp.finditer(msg)
+            if not m.group(0).startswith('://')  # Match inside a url
+        })
+        if not names:
+            return msg
+        ids: dict[str, str] = {}
+        users = await asyncio.gather(
+            *(self.sl_client.get_user_by_name(n) for n in names),
+            return_exceptions=True,
+        )
+        for name, user in zip(names, users):
+            if isinstance(user, slack.User):
+                ids[name] = user.id
+
+        def _repl(m: re.Match) -> str:
+            id_ = ids.get(m.group(0))
+            return m.group(0) if id_ is None else f'<@{id_}>'
+
+        return regexp.sub(_repl, msg)
+
+    async def parse_message(self, i: str) -> str:
+        '''
+        Convert a message from slack format into a message
+        an IRC user can understand.
+        '''
+        r_parts: list[str] = []
+        link_parts: list[str] = []
+        for t in msgparsing.tokenize(i):
+            if isinstance(t, str):
+                r_parts.append(_UNESCAPE_RE.sub(_unescape, t))
+            elif isinstance(t, msgparsing.PreBlock):
+                if self.settings.formatted_max_lines and t.lines > self.settings.formatted_max_lines:
+                    with tempfile.NamedTemporaryFile(
+                            mode='wt',
+                            dir=self.settings.downloads_directory,
+                            suffix='.txt',
+                            prefix=_ATTACHMENT_PREFIX,
+                            delete=False) as tmpfile:
+                        tmpfile.write(t.txt)
+                        r_parts.append(f'\n=== Preformatted text saved to {tmpfile.name}\n')
+                else:
+                    r_parts.append(f'```{t.txt}```')
+            else:  # SpecialItem
+                if t.kind == msgparsing.Itemkind.MENTION:
+                    user = await self.sl_client.get_user(t.val)
+                    r_parts.append('@' + user.name)
+                elif t.kind == msgparsing.Itemkind.CHANNEL:
+                    channel = await self.sl_client.get_channel(t.val)
+                    r_parts.append('#' + channel.name)
+                elif t.kind == msgparsing.Itemkind.GROUPMENTION:
+                    r_parts.append('@' + t.val)
+                else:
+                    label = t.human
+                    if label is None:
+                        r_parts.append(t.val)
+                    else:
+                        r_parts.append(label)
+                        link_parts.append('\n' + t.val)
+        return ''.join(r_parts) + ''.join(link_parts)
+
+    async def sendmsg(self, to: bytes, from_: bytes, message: str) -> None:
+        prefix = self._user_prefix(from_) + b'PRIVMSG ' + to + b' :'
+        buf = bytearray()
+        for line in message.split('\n'):
+            if not line:
+                continue
+            buf += prefix
+            buf += _enc(line)
+            buf += b'\r\n'
+        self.s.write(bytes(buf))
+        await self._maybe_drain()
+
+    async def _sendreply(self, code: Union[int, Replies], message: bytes, extratokens: Iterable[bytes] = []) -> None:
+        # Everything is bytes already: the replies are fixed byte
+        # literals at the call sites, so no encoding happens here.
+        # Hand the pieces to the transport's vectorized writer instead
+        # of concatenating them into yet another bytes object.
+        self.s.writelines((
+            b':',
+            _HOSTNAME,
+            b' %03d ' % code,
+            b' '.join(chain((self.nick,), extratokens)),
+            b' :',
+            message,
+            b'\r\n',
+        ))
+        await self._maybe_drain()
+
+    async def slack_event(self, sl_ev: slack.SlackEvent) -> None:
+        if not self._usersent:
+            if len(self._held_events) == self._held_events.maxlen:
+                log.warning('Held events queue full, dropping the oldest event')
+            self._held_events.append(sl_ev)
+            return
+        handler = self._event_handlers.get(type(sl_ev))
+        if handler is not None:
+            await handler(sl_ev)
+
+    async def _actionmessage(self, sl_ev: slack.ActionMessage) -> None:
+        await self._message(sl_ev, '[ACTION] ')
+
+    async def _joined(self, sl_ev: slack.Join) -> None:
+        await self._joined_parted(sl_ev.channel, sl_ev.user, True)
+
+    async def _left(self, sl_ev: slack.Leave) -> None:
+        await self._joined_parted(sl_ev.channel, sl_ev.user, False)
+
+    async def _groupjoined(self, sl_ev: slack.GroupJoined) -> None:
+        # The event carries the full channel: cache it so the messages
+        # that follow resolve without an API call.
+        self.sl_client.add_channel(sl_ev.channel)
+        channel_name = b'#' + sl_ev.channel.name_normalized.encode('utf-8')
+        await self._send_chan_info(channel_name, sl_ev.channel)
+
+    async def _message(self, sl_ev: Union[slack.Message, slack.MessageDelete], prefix: str = '') -> None:
+        text = sl_ev.text
+        mentioned = self._mention_str in text if self._mention_str else False
+
+        # Decide whether the message is wanted at all before paying for
+        # the user lookup.
+        if sl_ev.channel.startswith('C') or sl_ev.channel.startswith('G'):
+            channel = await self.sl_client.get_channel(sl_ev.channel)
+            dest = self._chan_dest(channel)
+            if dest in self.parted_channels and not mentioned:
+                # Ignoring messages, channel was left on IRC
+                return
+        else:
+            dest = self.nick
+
+        user = await self.sl_client.get_user(sl_ev.user)
+        source = self._enc_user(user)[0]
+
+        # Both sets are empty in the common configuration: checking the
+        # truthiness first skips hashing and scanning on every message.
+        yellers = self.settings.silenced_yellers
+        if yellers and dest is not self.nick \
+                and ('<!here>' in text or '<!channel>' in text or '<!everyone>' in text) \
+                and user.name in yellers:
+            text = text.replace('<!here>', 'here').replace('<!channel>', 'channel').replace('<!everyone>', 'everyone')
+
+        if self._annoy_users:
+            expiry = self._annoy_users.get(user.name)
+            if expiry is not None:
+                if expiry < self._loop.time():
+                    del self._annoy_users[user.name]
+                else:
+                    prefix = '[ANNOY] ' + prefix
+
+        msg = await self.parse_message(prefix + text)
+        await self.sendmsg(dest, source, msg)
+
+    async def _messageedit(self, sl_ev: slack.MessageEdit) -> None:
+        if not sl_ev.is_changed:
+            return
+        diffmsg = slack.Message(
+            channel=sl_ev.channel,
+            user=sl_ev.current.user,
+            text=seddiff(sl_ev.previous.text, sl_ev.current.text),
+            thread_ts=sl_ev.current.thread_ts,
+        )
+        await self._message(diffmsg)
+
+    async def _messagedeleted(self, sl_ev: slack.MessageDelete) -> None:
+        await self._message(sl_ev, '[deleted] ')
+
+    async def _joined_parted(self, channel_id: str, user_id: str, joined: bool) -> None:
+        channel = await self.sl_client.get_channel(channel_id)
+        name = '#' + channel.name
+        # Members changed: recompute the name set lazily. The compiled
+        # pattern itself is reused if the membership ends up identical.
+        self._mention_names_cache.pop(name, None)
+        self.sl_client.drop_members_cache(channel_id)
+        dest = _enc(name)
+        if dest in self.parted_channels:
+            return
+        user = await self.sl_client.get_user(user_id)
+        if user.deleted:
+            return
+        nick = self._enc_user(user)[0]
+        verb = b'JOIN ' if joined else b'PART '
+        self.s.write(self._user_prefix(nick) + verb + dest + b'\r\n')
+        await self._maybe_drain()
+
+    async def _topicchanged(self, sl_ev: slack.TopicChange) -> None:
+        channel = await self.sl_client.get_channel(sl_ev.channel)
+        user = await self.sl_client.get_user(sl_ev.user)
+        nick = self._enc_user(user)[0]
+        dest = self._chan_dest(channel)
+        self.s.write(self._user_prefix(nick) + b'TOPIC ' + dest + b' :' + _enc(sl_ev.topic) + b'\r\n')
+        await self._maybe_drain()
+
+    async def _usertyping(self, sl_ev: slack.UserTyping) -> None:
+        # Typing events only matter for ANNOY: tell on the annoyed
+        # users while they are still composing.
+        if not self._annoy_users:
+            return
+        user = await self.sl_client.get_user(sl_ev.user)
+        if user.name not in self._annoy_users:
+            return
+        key = (sl_ev.user, sl_ev.channel)
+        now = self._loop.time()
+        if self._last_typing.get(key, 0) + 4 > now:
+            return
+        self._last_typing[key] = now
+        await self.sendmsg(self.nick, self._enc_user(user)[0], 'is typing...')
+
+    async def send_message(self, dest: str, msg: str) -> None:
+        '''
+        Entry point for the control socket: send a message as the user.
+        '''
+        if dest.startswith('#'):
+            channel = await self.sl_client.get_channel_by_name(dest[1:])
+            await self.sl_client.send_message(channel.id, msg)
+        else:
+            user = await self.sl_client.get_user_by_name(dest)
+            await self.sl_client.send_message_to_user(user.id, msg)
+
+    async def send_file(self, dest: str, filename: str, content: bytes) -> None:
+        '''
+        Entry point for the control socket: upload a file.
+        '''
+        if dest.startswith('#'):
+            channel_id = (await self.sl_client.get_channel_by_name(dest[1:])).id
+        else:
+            channel_id = (await self.sl_client.get_user_by_name(dest)).id
+        await self.sl_client.send_file(channel_id, filename, content)
+
+    async def command(self, cmd: bytes) -> None:
+        sp = cmd.find(b' ')
+        command = (cmd if sp < 0 else cmd[:sp]).upper()
+
+        # PING is by far the most frequent command: skip the table.
+        if command == b'PING':
+            await self._pinghandler(cmd)
+            return
+
+        handler = _HANDLERS.get(command)
+        if handler is not None:
+            await handler(self, cmd)
+        else:
+            await self._sendreply(Replies.ERR_UNKNOWNCOMMAND, b'Unknown command', [command])
+
+
+# Shared by all clients and built a single time: the handlers are
+# plain functions here, bound at call time in command().
+_HANDLERS = {
+    b'NICK': Client._nickhandler,
+    b'USER': Client._userhandler,
+    b'PING': Client._pinghandler,
+    b'JOIN': Client._joinhandler,
+    b'PART': Client._parthandler,
+    b'PRIVMSG': Client._privmsghandler,
+    b'LIST': Client._listhandler,
+    b'WHO': Client._whohandler,
+    b'WHOIS': Client._whoishandler,
+    b'MODE': Client._modehandler,
+    b'AWAY': Client._awayhandler,
+    b'TOPIC': Client._topichandler,
+    b'ANNOY': Client._annoyhandler,
+    b'QUIT': Client._quithandler,
+}
+
+
+def su() -> None:
+    '''
+    Drop privileges, if running as root.
+    '''
+    if os.getuid() != 0:
+        return
+    gid = int(os.environ.get('PGID', '1000'))
+    uid = int(os.environ.get('PUID', '1000'))
+    os.setgroups([])
+    if hasattr(os, 'setresgid'):
+        # Set real, effective and saved id in one syscall each, with no
+        # intermediate partially-dropped state.
+        os.setresgid(gid, gid, gid)
+        os.setresuid(uid, uid, uid)
+    else:
+        os.setgid(gid)
+        os.setegid(gid)
+        os.setuid(uid)
+        os.seteuid(uid)
+
+
+async def slack_loop(ircclient: Client, sl_client: slack.Slack) -> None:
+    try:
+        async for ev in sl_client.events():
+            await ircclient.slack_event(ev)
+    finally:
+        # events() reconnects on its own, so reaching this point means
+        # the pump is truly dead: drop the IRC connection too, so the
+        # user's client notices and reconnects into a fresh session.
+        ircclient.s.close()
+
+
+async def serve_client(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        sl_client: slack.Slack,
+        settings: ClientSettings,
+        control_socket: Optional[str],
+) -> None:
+    # IRC responses are tiny: without TCP_NODELAY Nagle can hold a PONG
+    # or a message echo back for tens of milliseconds.
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    # Give the transport more headroom than the 64 KiB default before
+    # it pauses the protocol: bursts like a JOIN of a big channel fit
+    # in the buffer and _maybe_drain keeps its fast path.
+    writer.transport.set_write_buffer_limits(high=256 * 1024, low=64 * 1024)
+
+    ircclient = Client(writer, sl_client, settings)
+
+    tasks = [asyncio.create_task(slack_loop(ircclient, sl_client))]
+    if control_socket:
+        tasks.append(asyncio.create_task(control.listen(ircclient, control_socket)))
+
+    try:
+        # Read in bulk and split lines in-process: a paste burst or the
+        # login handshake arrives as one packet but would cost one
+        # event-loop round trip per line through readline().
+        buf = bytearray()
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            buf += chunk
+            while (i := buf.find(b'\n')) >= 0:
+                line = bytes(buf[:i]).rstrip(b'\r')
+                del buf[:i + 1]
+                if line:
+                    await ircclient.command(line)
+            if len(buf) > _MAX_LINE:
+                log.warning('Dropping client: %d bytes without a newline', len(buf))
+                break
+    finally:
+        for t in tasks:
+            t.cancel()
+        writer.close()
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Slack gateway for IRC clients')
+    parser.add_argument('-p', '--port', type=int, default=9007)
+    parser.add_argument('-i', '--ip', type=str, default='127.0.0.1')
+    parser.add_argument('-t', '--tokenfile', type=str, required=True)
+    parser.add_argument('-c', '--cookiefile', type=str, default=None)
+    parser.add_argument('-u', '--nouserlist', action='store_true')
+    parser.add_argument('-j', '--autojoin', action='store_true')
+    parser.add_argument('-d', '--downloads-directory', type=str, default='/tmp')
+    parser.add_argument('--formatted-max-lines', type=int, default=0)
+    parser.add_argument('--silenced-yellers', type=str, default='')
+    parser.add_argument('--ignored-channels', type=str, default='')
+    parser.add_argument('--control-socket', type=str, default=None)
+    return parser
+
+
+async def amain() -> None:
+    su()
+
+    # Most scheduled coroutines (slack_event with warm caches, command
+    # handlers) finish without suspending: run them eagerly instead of
+    # round-tripping through the scheduler, where the runtime allows.
+    loop = asyncio.get_running_loop()
+    if hasattr(asyncio, 'eager_task_factory'):
+        loop.set_task_factory(asyncio.eager_task_factory)
+    loop.add_signal_handler(signal.SIGINT, lambda: os._exit(0))
+    loop.add_signal_handler(signal.SIGTERM, lambda: os._exit(0))
+
+    # The configuration cannot change while the process runs: parse the
+    # command line, read the secrets and validate once, instead of on
+    # every reconnection.
+    args = _build_parser().parse_args()
+    token = Path(args.tokenfile).read_text().strip()
+    cookie = Path(args.cookiefile).read_text().strip() if args.cookiefile else None
+
+    settings = ClientSettings(
+        nouserlist=args.nouserlist,
+        autojoin=args.autojoin,
+        downloads_directory=Path(args.downloads_directory),
+        formatted_max_lines=args.formatted_max_lines,
+        silenced_yellers=frozenset(i for i in args.silenced_yellers.split(',') if i),
+        ignored_channels=frozenset(b'#' + i.encode('utf8') for i in args.ignored_channels.split(',') if i),
+    )
+    error = await settings.verify()
+    if error:
+        raise SystemExit(error)
+
+    while True:
+        sl_client = slack.Slack(token, cookie)
+        try:
+            await sl_client.login()
+        except Exception:
+            log.exception('Unable to login, retrying')
+            await asyncio.sleep(10)
+            continue
+
+        # A backlog above 1 avoids refusing the connection attempts a
+        # reconnecting client fires in quick succession, and reuse_port
+        # removes the bind race when the process restarts.
+        server = await asyncio.start_server(
+            lambda r, w: serve_client(r, w, sl_client, settings, args.control_socket),
+            args.ip,
+            args.port,
+            backlog=16,
+            reuse_port=hasattr(socket, 'SO_REUSEPORT'),
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        except Exception:
+            log.exception('Server terminated, reconnecting')
+        finally:
+            await sl_client.close()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(amain())
+
+
+if __name__ == '__main__':
+    main()
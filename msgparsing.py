@@ -0,0 +1,144 @@
+# localslackirc
+# Copyright (C) 2021-2026 Salvo "LtWorf" Tomaselli
+#
+# localslackirc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# localslackirc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with localslackirc.  If not, see <http://www.gnu.org/licenses/>.
+
+from enum import Enum
+from typing import Iterator, NamedTuple, Optional, Union
+
+__all__ = [
+    'SLACK_SUBSTITUTIONS',
+    'Itemkind',
+    'PreBlock',
+    'SpecialItem',
+    'tokenize',
+]
+
+
+# Substitutions performed by the Slack API on message text.
+# The first element is what appears on the wire, the second the
+# actual character.
+SLACK_SUBSTITUTIONS = [
+    ('&amp;', '&'),
+    ('&lt;', '<'),
+    ('&gt;', '>'),
+]
+
+
+class Itemkind(Enum):
+    MENTION = '@'  # A mention to a user
+    CHANNEL = '#'  # A link to a channel
+    GROUPMENTION = '!'  # @here, @channel and so on
+    OTHER = ''  # Link or other undecoded thing
+
+
+class PreBlock(NamedTuple):
+    '''
+    Block of preformatted text
+    '''
+    txt: str
+
+    @property
+    def lines(self) -> int:
+        return self.txt.count('\n')
+
+
+class SpecialItem(NamedTuple):
+    '''
+    The content of a <> block from a slack message
+    '''
+    txt: str
+
+    @property
+    def kind(self) -> Itemkind:
+        k = self.txt[1]
+        if k == '@':
+            return Itemkind.MENTION
+        elif k == '#':
+            return Itemkind.CHANNEL
+        elif k == '!':
+            return Itemkind.GROUPMENTION
+        return Itemkind.OTHER
+
+    @property
+    def val(self) -> str:
+        '''
+        The value, until the |
+        '''
+        sep = self.txt.find('|')
+        begin = 1 if self.kind == Itemkind.OTHER else 2
+        if sep == -1:
+            return self.txt[begin:-1]
+        return self.txt[begin:sep]
+
+    @property
+    def human(self) -> Optional[str]:
+        '''
+        The human readable part, after the |
+        '''
+        sep = self.txt.find('|')
+        if sep == -1:
+            return None
+        return self.txt[sep + 1:-1]
+
+
+def preblocks(msg: str) -> Iterator[tuple[str, bool]]:
+    '''
+    Iterates the string, splitting on ``` markers.
+
+    Yields (text, is_preformatted) pairs.
+    '''
+    pre = False
+    while True:
+        p = msg.find('```')
+        if p == -1:
+            yield msg, pre
+            return
+        yield msg[0:p], pre
+        msg = msg[p + 3:]
+        pre = not pre
+
+
+def split_tokens(msg: str) -> Iterator[Union[str, SpecialItem]]:
+    '''
+    Yields the plain text parts of a non-preformatted block
+    interleaved with the <> special items it contains.
+    '''
+    while True:
+        begin = msg.find('<')
+        if begin == -1:
+            if msg:
+                yield msg
+            return
+        end = msg.find('>', begin)
+        if end == -1:
+            if msg:
+                yield msg
+            return
+        if begin:
+            yield msg[0:begin]
+        yield SpecialItem(msg[begin:end + 1])
+        msg = msg[end + 1:]
+
+
+def tokenize(msg: str) -> Iterator[Union[str, SpecialItem, PreBlock]]:
+    '''
+    Yields the message as a sequence of plain strings,
+    special items and preformatted blocks.
+    '''
+    for txt, pre in preblocks(msg):
+        if pre:
+            yield PreBlock(txt)
+        else:
+            yield from split_tokens(txt)
@@ -0,0 +1,428 @@
+# localslackirc
+# Copyright (C) 2018-2026 Salvo "LtWorf" Tomaselli
+#
+# localslackirc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# localslackirc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with localslackirc.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterable, Optional, Union
+
+import aiohttp
+from typedload import load
+
+__all__ = [
+    'ResponseException',
+    'Profile',
+    'User',
+    'Topic',
+    'Channel',
+    'Message',
+    'ActionMessage',
+    'MessageEdit',
+    'MessageDelete',
+    'Join',
+    'Leave',
+    'TopicChange',
+    'GroupJoined',
+    'UserTyping',
+    'SlackEvent',
+    'LoginInfo',
+    'Slack',
+]
+
+log = logging.getLogger(__name__)
+
+# Multi party IMs that had no activity for this long are not joined.
+MPIM_CUTOFF = datetime.timedelta(days=300)
+
+
+class ResponseException(Exception):
+    pass
+
+
+@dataclass
+class Profile:
+    real_name: str = 'noname'
+    email: Optional[str] = None
+    status_text: str = ''
+
+
+@dataclass(frozen=True)
+class User:
+    id: str
+    name: str
+    profile: Profile
+    is_admin: bool = False
+    deleted: bool = False
+
+    @property
+    def real_name(self) -> str:
+        return self.profile.real_name
+
+
+@dataclass
+class Topic:
+    value: str = ''
+
+
+@dataclass(frozen=True)
+class Channel:
+    id: str
+    name_normalized: str
+    topic: Topic = field(default_factory=Topic)
+    num_members: int = 0
+    is_member: bool = True
+    is_im: bool = False
+    is_mpim: bool = False
+
+    @property
+    def name(self) -> str:
+        return self.name_normalized
+
+
+@dataclass(frozen=True)
+class Message:
+    channel: str  # The id of the channel
+    user: str  # The id of the user
+    text: str
+    thread_ts: Optional[str] = None
+
+
+class ActionMessage(Message):
+    pass
+
+
+@dataclass
+class MessageEdit:
+    channel: str
+    previous: Message
+    current: Message
+
+    @property
+    def is_changed(self) -> bool:
+        return self.previous.text != self.current.text
+
+
+@dataclass
+class MessageDelete:
+    channel: str
+    user: str
+    text: str
+
+
+@dataclass
+class Join:
+    user: str
+    channel: str
+
+
+@dataclass
+class Leave:
+    user: str
+    channel: str
+
+
+@dataclass
+class TopicChange:
+    topic: str
+    channel: str
+    user: str
+
+
+@dataclass
+class GroupJoined:
+    channel: Channel
+
+
+@dataclass
+class UserTyping:
+    user: str
+    channel: str
+
+
+SlackEvent = Union[
+    TopicChange,
+    MessageDelete,
+    MessageEdit,
+    Message,
+    ActionMessage,
+    GroupJoined,
+    Join,
+    Leave,
+    UserTyping,
+]
+
+
+@dataclass
+class SelfInfo:
+    id: str
+    name: str
+
+
+@dataclass
+class TeamInfo:
+    id: str
+    name: str
+
+
+@dataclass
+class LoginInfo:
+    team: TeamInfo
+    self: SelfInfo
+
+
+class Slack:
+    def __init__(self, token: str, cookie: Optional[str] = None) -> None:
+        self.token = token
+        self.cookie = cookie
+        self.login_info: Optional[LoginInfo] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ws_url: Optional[str] = None
+        self._usercache: dict[str, User] = {}
+        self._usermapcache: dict[str, User] = {}
+        self._channelscache: list[Channel] = []
+        self._channels_by_name: dict[str, Channel] = {}
+        self._channels_by_id: dict[str, Channel] = {}
+        self._get_members_cache: dict[str, set[str]] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            headers = {'Authorization': 'Bearer ' + self.token}
+            if self.cookie:
+                headers['Cookie'] = self.cookie
+            self._session = aiohttp.ClientSession(headers=headers)
+        return self._session
+
+    async def _request(self, endpoint: str, **data: Any) -> dict[str, Any]:
+        async with self.session.post('https://slack.com/api/' + endpoint, data=data) as resp:
+            if resp.status != 200:
+                raise ResponseException('HTTP status %d on %s' % (resp.status, endpoint))
+            r = await resp.json()
+        if not r.get('ok'):
+            raise ResponseException('%s: %s' % (endpoint, r.get('error')))
+        return r
+
+    async def login(self) -> None:
+        r = await self._request('rtm.connect')
+        self.login_info = load(r, LoginInfo, failonextra=False)
+        self._ws_url = r['url']
+
+    async def events(self) -> AsyncIterator[SlackEvent]:
+        '''
+        Connect to the websocket and yield the decoded events.
+
+        Slack closes the websocket routinely: when the stream ends a
+        new rtm.connect is performed and the iteration keeps going, so
+        callers never see the reconnections.
+        '''
+        while True:
+            if self._ws_url is None:
+                try:
+                    await self.login()
+                except (ResponseException, aiohttp.ClientError):
+                    log.exception('Unable to reconnect to slack, retrying')
+                    await asyncio.sleep(10)
+                    continue
+            assert self._ws_url is not None
+            try:
+                async with self.session.ws_connect(self._ws_url) as ws:
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        try:
+                            ev = self._loadevent(json.loads(msg.data))
+                        except Exception:
+                            log.exception('Unable to parse event %s', msg.data)
+                            continue
+                        if ev is not None:
+                            yield ev
+            except aiohttp.ClientError:
+                log.exception('Websocket connection lost, reconnecting')
+            # The url is single use: get a fresh one on the next round
+            self._ws_url = None
+            await asyncio.sleep(1)
+
+    def _loadevent(self, data: dict[str, Any]) -> Optional[SlackEvent]:
+        t = data.get('type')
+        subtype = data.get('subtype')
+        if t == 'message':
+            if subtype == 'message_changed':
+                previous = load(data['previous_message'], Message, failonextra=False)
+                current = load(data['message'], Message, failonextra=False)
+                return MessageEdit(channel=data['channel'], previous=previous, current=current)
+            elif subtype == 'message_deleted':
+                previous = load(data['previous_message'], Message, failonextra=False)
+                return MessageDelete(channel=data['channel'], user=previous.user, text=previous.text)
+            elif subtype == 'me_message':
+                return load(data, ActionMessage, failonextra=False)
+            elif subtype is None:
+                return load(data, Message, failonextra=False)
+            return None
+        elif t == 'member_joined_channel':
+            return load(data, Join, failonextra=False)
+        elif t == 'member_left_channel':
+            return load(data, Leave, failonextra=False)
+        elif t == 'group_joined':
+            return GroupJoined(load(data['channel'], Channel, failonextra=False))
+        elif t == 'user_typing':
+            return load(data, UserTyping, failonextra=False)
+        return None
+
+    async def get_user(self, id_: str) -> User:
+        if id_ in self._usercache:
+            return self._usercache[id_]
+        r = await self._request('users.info', user=id_)
+        u = load(r['user'], User, failonextra=False)
+        self._usercache[id_] = u
+        self._usermapcache[u.name] = u
+        return u
+
+    async def get_users(self, ids: Iterable[str]) -> list[User]:
+        '''
+        Fetch the given users concurrently, so cache misses overlap
+        instead of paying one round trip each. Users that cannot be
+        resolved are skipped.
+        '''
+        r = await asyncio.gather(*(self.get_user(i) for i in ids), return_exceptions=True)
+        return [u for u in r if isinstance(u, User)]
+
+    async def get_user_by_name(self, name: str) -> User:
+        if name not in self._usermapcache:
+            await self.prefetch_users()
+        return self._usermapcache[name]
+
+    async def get_usernames(self) -> list[str]:
+        if not self._usermapcache:
+            await self.prefetch_users()
+        return list(self._usermapcache.keys())
+
+    async def prefetch_users(self) -> None:
+        r = await self._request('users.list')
+        for u in load(r['members'], list[User], failonextra=False):
+            self._usercache[u.id] = u
+            self._usermapcache[u.name] = u
+
+    def add_channel(self, channel: Channel) -> None:
+        '''
+        Insert a channel into the caches.
+
+        Used for channels learned outside of the listing, such as the
+        one carried by a group_joined event, so later lookups do not
+        pay an HTTP round trip each.
+        '''
+        if channel.id not in self._channels_by_id:
+            self._channelscache.append(channel)
+        self._channels_by_id[channel.id] = channel
+        self._channels_by_name[channel.name] = channel
+
+    async def get_channel(self, id_: str) -> Channel:
+        c = self._channels_by_id.get(id_)
+        if c is not None:
+            return c
+        r = await self._request('conversations.info', channel=id_)
+        c = load(r['channel'], Channel, failonextra=False)
+        self.add_channel(c)
+        return c
+
+    async def get_channel_by_name(self, name: str) -> Channel:
+        if not self._channels_by_name:
+            await self.channels()
+        c = self._channels_by_name.get(name)
+        if c is not None:
+            return c
+        # There is no channel_created event on this stream, so a miss
+        # may just mean the cached listing predates the channel:
+        # refresh once before giving up.
+        await self.channels(refresh=True)
+        return self._channels_by_name[name]
+
+    async def channels(self, refresh: bool = False) -> list[Channel]:
+        if self._channelscache and not refresh:
+            return self._channelscache
+        r = await self._request(
+            'conversations.list',
+            types='public_channel,private_channel,mpim',
+            exclude_archived='true',
+            limit=1000,
+        )
+        # Slack timestamps are Unix time: one clock read before the
+        # scan and a float comparison per mpim, instead of datetime
+        # arithmetic in the loop.
+        mpim_cutoff_ts = time.time() - MPIM_CUTOFF.total_seconds()
+        self._channelscache = []
+        for i in r['channels']:
+            c = load(i, Channel, failonextra=False)
+            if c.is_mpim:
+                # Do not bother to join old conversations
+                latest = i.get('latest', {}).get('ts')
+                if latest is not None and float(latest) < mpim_cutoff_ts:
+                    continue
+            self._channelscache.append(c)
+        self._channels_by_name = {c.name: c for c in self._channelscache}
+        self._channels_by_id = {c.id: c for c in self._channelscache}
+        return self._channelscache
+
+    def drop_members_cache(self, id_: str) -> None:
+        '''
+        Forget the cached member list of a channel.
+
+        Called when a join or leave event makes it stale.
+        '''
+        self._get_members_cache.pop(id_, None)
+
+    async def get_members(self, id_: str) -> set[str]:
+        if id_ in self._get_members_cache:
+            return self._get_members_cache[id_]
+        r = await self._request('conversations.members', channel=id_, limit=5000)
+        members = set(r['members'])
+        self._get_members_cache[id_] = members
+        return members
+
+    async def send_message(self, channel_id: str, msg: str, action: bool = False, thread_ts: Optional[str] = None) -> None:
+        if action:
+            msg = '/me ' + msg
+        kwargs = {}
+        if thread_ts:
+            kwargs['thread_ts'] = thread_ts
+        await self._request('chat.postMessage', channel=channel_id, text=msg, as_user='true', **kwargs)
+
+    async def send_message_to_user(self, user_id: str, msg: str, action: bool = False) -> None:
+        r = await self._request('conversations.open', users=user_id)
+        await self.send_message(r['channel']['id'], msg, action)
+
+    async def send_file(self, channel_id: str, filename: str, content: bytes) -> None:
+        await self._request('files.upload', channels=channel_id, filename=filename, file=content)
+
+    async def topic(self, channel_id: str, topic: str) -> None:
+        await self._request('conversations.setTopic', channel=channel_id, topic=topic)
+
+    async def kick(self, channel_id: str, user_id: str) -> None:
+        await self._request('conversations.kick', channel=channel_id, user=user_id)
+
+    async def invite(self, channel_id: str, user_id: str) -> None:
+        await self._request('conversations.invite', channel=channel_id, users=user_id)
+
+    async def away(self, is_away: bool) -> None:
+        presence = 'away' if is_away else 'auto'
+        await self._request('users.setPresence', presence=presence)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None